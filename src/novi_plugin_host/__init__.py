@@ -1,32 +1,50 @@
 import atexit
 import json
 import multiprocessing as mp
+import os
+import sys
+import threading
 import yaml
 
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from functools import cache
+from graphlib import TopologicalSorter
 from importlib.metadata import entry_points
 from importlib.util import find_spec
 from itertools import chain
 from pathlib import Path
 from pydantic import ValidationError
 from structlog import get_logger
-from toposort import toposort_flatten
 
 from novi import Session
 
 from .config import Config, PluginConfig, PluginMetadata
 from .entry import EntryConfig, entry_main
+from .misc import yaml_loader
 
 from collections.abc import Iterator
 from typing import Any, TYPE_CHECKING
 
 if TYPE_CHECKING:
+    from importlib.metadata import EntryPoint, EntryPoints
+
     from .entry import EntryMain
 
 lg = get_logger()
 
+# Children are forked from a server that has already imported the plugin
+# runtime, instead of each one starting a fresh interpreter.
+if sys.platform == 'win32':
+    mp_ctx = mp.get_context('spawn')
+else:
+    mp_ctx = mp.get_context('forkserver')
+    mp_ctx.set_forkserver_preload(['novi_plugin_host.entry', 'novi.plugin'])
+
 plugins = {}
 
+DEFAULT_PLUGIN_CONFIG = PluginConfig()
+
 
 def plugin_user(session: Session, identifier: str, permissions: set[str]):
     users = session.query(
@@ -56,7 +74,7 @@ def load_plugin_metadata(dir: Path, default: dict) -> PluginMetadata | None:
     try:
         meta = default
         with (dir / 'plugin.yaml').open() as f:
-            meta.update(yaml.safe_load(f))
+            meta.update(yaml.load(f, Loader=yaml_loader()))
         return PluginMetadata.model_validate(meta)
     except FileNotFoundError:
         lg.error('plugin config not found')
@@ -66,38 +84,66 @@ def load_plugin_metadata(dir: Path, default: dict) -> PluginMetadata | None:
     return None
 
 
-@dataclass
+@dataclass(slots=True)
 class PluginDesc:
     dir: Path
     main: 'EntryMain'
     default_meta: dict[str, Any]
 
 
+# Core metadata field names are case-insensitive
+DIST_METADATA_KEYS = {
+    'description': 'description',
+    'keywords': 'keywords',
+    'version': 'version',
+    'license': 'license',
+    'home-page': 'homepage',
+}
+
+
+@cache
+def plugin_entry_points() -> 'EntryPoints':
+    return entry_points(group='novi.plugin')
+
+
+def entry_point_dir(entry: 'EntryPoint') -> Path:
+    # Locate the module through its distribution first; find_spec has to go
+    # through the import system.
+    if entry.dist is not None:
+        path = Path(entry.dist.locate_file(entry.module.replace('.', '/')))
+        if path.is_dir():
+            return path
+        if path.with_suffix('.py').is_file():
+            return path.parent
+
+    return Path(find_spec(entry.module).origin).parent
+
+
 def find_package_plugins() -> Iterator[PluginDesc]:
     from .entry import EntryMain
 
-    entries = entry_points(group='novi.plugin')
-    for entry in entries:
+    for entry in plugin_entry_points():
         lg.debug('loading plugin from module', entry=entry)
 
-        dir = Path(find_spec(entry.module).origin).parent
+        dir = entry_point_dir(entry)
 
         config = {
             'name': entry.name,
             'identifier': f'{entry.module}.{entry.name}',
         }
         if entry.dist:
-            meta = entry.dist.metadata
-            if 'Description' in meta:
-                config['description'] = meta['Description']
-            if 'Keywords' in meta:
-                config['keywords'] = list(meta['Keywords'].split(','))
-            if 'Version' in meta:
-                config['version'] = meta['Version']
-            if 'License' in meta:
-                config['license'] = meta['License']
-            if 'Home-page' in meta:
-                config['homepage'] = meta['Home-page']
+            # Reversed so the first of any repeated header wins, like
+            # Message.get
+            meta = {
+                k.lower(): v
+                for k, v in reversed(entry.dist.metadata.items())
+            }
+            for header, key in DIST_METADATA_KEYS.items():
+                value = meta.get(header)
+                if value is not None:
+                    config[key] = value
+            if 'keywords' in config:
+                config['keywords'] = config['keywords'].split(',')
 
         yield PluginDesc(
             dir=dir,
@@ -109,12 +155,16 @@ def find_package_plugins() -> Iterator[PluginDesc]:
 def find_simple_plugins(plugin_dir: Path) -> Iterator[PluginDesc]:
     from .entry import EntryMain
 
-    for dir in plugin_dir.iterdir():
-        if not dir.is_dir():
-            continue
-        if any(not (dir / f).is_file() for f in ('main.py', 'plugin.yaml')):
+    with os.scandir(plugin_dir) as it:
+        entries = [entry for entry in it if entry.is_dir()]
+
+    for entry in entries:
+        with os.scandir(entry.path) as it:
+            files = {f.name for f in it if f.is_file()}
+        if not {'main.py', 'plugin.yaml'} <= files:
             continue
 
+        dir = Path(entry.path)
         lg.debug('loading plugin from directory', dir=dir)
 
         config = {
@@ -122,20 +172,78 @@ def find_simple_plugins(plugin_dir: Path) -> Iterator[PluginDesc]:
         }
         yield PluginDesc(
             dir=dir,
-            main=EntryMain(file_path=str((dir / 'main.py').resolve())),
+            main=EntryMain(
+                file_path=os.path.realpath(os.path.join(entry.path, 'main.py'))
+            ),
             default_meta=config,
         )
 
 
+def read_plugin_config(desc: PluginDesc) -> dict[str, Any]:
+    with (desc.dir / 'plugin.yaml').open() as f:
+        return yaml.load(f, Loader=yaml_loader()) or {}
+
+
+class ReadyPipe:
+    # Every plugin process reports its identifier over this one pipe once it
+    # has registered, instead of each spawn allocating its own Event.
+    # Restarts may wait from several threads at once: only one of them reads
+    # the pipe at a time, the others wait for it to update the ready set.
+
+    def __init__(self):
+        self.reader, self.writer = mp_ctx.Pipe(duplex=False)
+        self.ready: set[str] = set()
+        self.cond = threading.Condition()
+        self.reading = False
+
+    def reset(self, identifier: str):
+        with self.cond:
+            self.ready.discard(identifier)
+
+    def wait(self, identifier: str):
+        with self.cond:
+            while identifier not in self.ready:
+                if self.reading:
+                    self.cond.wait()
+                    continue
+
+                self.reading = True
+                self.cond.release()
+                try:
+                    registered = self.reader.recv_bytes().decode()
+                finally:
+                    self.cond.acquire()
+                    self.reading = False
+                    self.cond.notify_all()
+
+                self.ready.add(registered)
+
+
 class PluginState:
+    __slots__ = (
+        'plugin_dir',
+        'config',
+        'metadata',
+        'entry_config',
+        'entry_payload',
+        'dependencies',
+        'depended_by',
+        'reverse_closure',
+        'ready',
+        'process',
+    )
+
     plugin_dir: Path
     config: PluginConfig
     metadata: PluginMetadata
     entry_config: EntryConfig
+    entry_payload: bytes
     dependencies: set[str]
     depended_by: set[str]
+    reverse_closure: frozenset[str]
+    ready: ReadyPipe
 
-    process: mp.Process | None = None
+    process: mp.Process | None
 
     def __init__(
         self,
@@ -143,49 +251,62 @@ class PluginState:
         config: PluginConfig,
         metadata: PluginMetadata,
         entry_config: EntryConfig,
+        ready: ReadyPipe,
     ):
         self.plugin_dir = plugin_dir
         self.config = config
         self.metadata = metadata
         self.entry_config = entry_config
+        self.entry_payload = entry_config.to_json_bytes()
         self.dependencies = set()
         self.depended_by = set()
+        self.reverse_closure = frozenset()
+        self.ready = ready
+        self.process = None
 
     @property
     def identifier(self):
         return self.metadata.identifier
 
-    def spawn(self):
+    def start(self):
         lg.info('loading plugin', identifier=self.metadata.identifier)
-        registered = mp.Event()
-        child = mp.Process(
+        self.ready.reset(self.identifier)
+        child = mp_ctx.Process(
             target=entry_main,
-            args=(self.entry_config, self.plugin_dir, registered),
+            args=(self.entry_payload, str(self.plugin_dir), self.ready.writer),
         )
         child.start()
-        registered.wait()
         atexit.register(child.terminate)
         self.process = child
 
+    def wait_registered(self):
+        self.ready.wait(self.identifier)
+
+    def spawn(self):
+        self.start()
+        self.wait_registered()
+
 
 def load_plugins(
     config: Config, session: Session
 ) -> tuple[dict[str, PluginState], list[str]]:
-    plugin_data_dir = Path('data')
+    plugin_data_dir = Path('data').absolute()
+    plugin_data_dir.mkdir(parents=True, exist_ok=True)
     server = config.server
 
-    plugin_descs = chain(
-        find_package_plugins(), find_simple_plugins(config.plugins_path)
+    plugin_descs = list(
+        chain(find_package_plugins(), find_simple_plugins(config.plugins_path))
     )
+    # plugin.yaml reads are I/O bound, so fetch them all up front
+    with ThreadPoolExecutor(max_workers=min(32, len(plugin_descs) or 1)) as ex:
+        contents = [ex.submit(read_plugin_config, d) for d in plugin_descs]
+
+    ready = ReadyPipe()
     plugins: dict[str, PluginState] = {}
-    for desc in plugin_descs:
+    for desc, content in zip(plugin_descs, contents):
         try:
             plugin_meta = desc.default_meta
-
-            with (desc.dir / 'plugin.yaml').open() as f:
-                content = yaml.safe_load(f)
-                if content is not None:
-                    plugin_meta.update(content)
+            plugin_meta.update(content.result())
 
             plugin_meta = PluginMetadata.model_validate(plugin_meta)
 
@@ -196,13 +317,15 @@ def load_plugins(
             lg.exception('invalid plugin metadata')
             continue
 
-        lg.debug('plugin metadata', metadata=plugin_meta.model_dump())
+        lg.debug('plugin metadata', metadata=plugin_meta)
 
         identifier = plugin_meta.identifier
         if identifier in plugins:
             raise ValueError(f'duplicate plugin identifier: {identifier}')
 
-        plugin_config = config.plugin_config.get(identifier, PluginConfig())
+        plugin_config = config.plugin_config.get(
+            identifier, DEFAULT_PLUGIN_CONFIG
+        )
         if plugin_config.disabled:
             lg.info('plugin disabled', identifier=identifier)
             continue
@@ -217,42 +340,78 @@ def load_plugins(
 
         identity = session.login_as(user.id)
 
+        config_template = None
+        if plugin_meta.config_template:
+            config_template = os.path.realpath(
+                os.path.join(desc.dir, plugin_meta.config_template)
+            )
+
         entry_config = EntryConfig(
             identifier=identifier,
             server=server,
             identity=identity.token,
-            config_template=(desc.dir / plugin_meta.config_template).resolve(),
+            config_template=config_template,
             ipfs_gateway=config.ipfs_gateway,
             main=desc.main,
         )
 
         plugin_dir = plugin_data_dir / identifier
-        plugin_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            os.mkdir(plugin_dir)
+        except FileNotFoundError:
+            # identifiers containing a path separator get nested directories
+            plugin_dir.mkdir(parents=True, exist_ok=True)
+        except FileExistsError:
+            if not plugin_dir.is_dir():
+                raise
 
         plugins[identifier] = PluginState(
-            plugin_dir, plugin_config, plugin_meta, entry_config
+            plugin_dir, plugin_config, plugin_meta, entry_config, ready
         )
 
-    dependencies = {}
+    dependencies = {identifier: set() for identifier in plugins}
+    depended_by = {identifier: set() for identifier in plugins}
     for identifier, state in plugins.items():
+        deps = dependencies[identifier]
         for req in state.metadata.requirements:
-            if not req.startswith('depends:'):
+            kind, sep, dep = req.partition(':')
+            if not sep or kind != 'depends':
                 lg.warn('unknown requirement', requirement=req)
+                continue
 
-            dep = req[len('depends:') :]
-            if dep not in plugins:
-                raise ValueError(f'missing dependency {dep}')
-
-            plugins[dep].depended_by.add(identifier)
-            state.dependencies.add(dep)
-
-        dependencies[identifier] = state.dependencies
+            if dep == identifier:
+                lg.warn('plugin depends on itself', identifier=identifier)
+                continue
 
-    mp.set_start_method('spawn')
+            if dep not in depended_by:
+                raise ValueError(f'missing dependency {dep}')
 
-    topo = toposort_flatten(dependencies)
+            deps.add(dep)
+            depended_by[dep].add(identifier)
 
-    for identifier in topo:
-        plugins[identifier].spawn()
+    for identifier, state in plugins.items():
+        state.dependencies = dependencies[identifier]
+        state.depended_by = depended_by[identifier]
+
+    # Plugins within the same level don't depend on each other, so start
+    # them all before waiting for any of them to register.
+    sorter = TopologicalSorter(dependencies)
+    sorter.prepare()
+    topo = []
+    while sorter.is_active():
+        level = sorted(sorter.get_ready())
+        for identifier in level:
+            plugins[identifier].start()
+        for identifier in level:
+            plugins[identifier].wait_registered()
+        sorter.done(*level)
+        topo.extend(level)
+
+    # Everything that (transitively) depends on a plugin, itself included
+    for identifier in reversed(topo):
+        state = plugins[identifier]
+        state.reverse_closure = frozenset({identifier}).union(
+            *(plugins[dep].reverse_closure for dep in state.depended_by)
+        )
 
     return plugins, topo
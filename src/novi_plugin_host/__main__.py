@@ -1,4 +1,3 @@
-import grpc
 import yaml
 
 from structlog import get_logger
@@ -9,7 +8,7 @@ from novi.errors import InvalidArgumentError
 
 from . import load_plugins
 from .config import Config, PluginMetadata
-from .misc import init_log
+from .misc import init_log, yaml_loader
 
 lg = get_logger('novi_plugin_host')
 
@@ -18,12 +17,8 @@ def init(config: Config):
     config.plugins_path.mkdir(parents=True, exist_ok=True)
 
 
-with open('config.yaml') as f:
-    config = Config.model_validate(yaml.safe_load(f))
-
-
 plugins = {}
-topo = []
+topo_index = {}
 
 
 class PluginInfo(BaseModel):
@@ -44,7 +39,7 @@ def list_plugins(session: Session) -> dict[str, PluginInfo]:
     return result
 
 
-def restart_plugin(plugin: str) -> dict[str, str]:
+def restart_plugin(session: Session, plugin: str) -> dict[str, str]:
     session.check_permission('plugin.restart')
 
     lg.info('restarting plugin', plugin=plugin)
@@ -53,46 +48,53 @@ def restart_plugin(plugin: str) -> dict[str, str]:
     if state is None:
         raise InvalidArgumentError(f'unknown plugin: {plugin}')
 
-    to_restart = {state.identifier}
-    q = [state]
-    i = 0
-    while i < len(q):
-        plg = q[i]
-        i += 1
-
-        for dep in plg.depended_by:
-            if to_restart.add(dep):
-                q.append(plugins[dep])
+    to_restart = state.reverse_closure
 
-    restarted = []
-    for ident in topo[::-1]:
-        if ident in to_restart:
-            restarted.append(ident)
-            plg = plugins[ident]
-            plg.process.terminate()
-            plg.process.join()
+    # Stop dependents before what they depend on, then bring everything back
+    # up in dependency order
+    restarted = sorted(to_restart, key=topo_index.get, reverse=True)
+    for ident in restarted:
+        plg = plugins[ident]
+        plg.process.terminate()
+        plg.process.join()
 
-            plg.spawn()
+    for ident in reversed(restarted):
+        plugins[ident].spawn()
 
     return {'restarted': restarted}
 
 
-init_log()
-init(config)
-with grpc.insecure_channel(
-    config.server, options=(('grpc.default_authority', 'localhost'),)
-) as channel:
-    client = Client(channel)
-    identity = client.use_master_key(config.master_key)
-    with client.session(SessionMode.IMMEDIATE, identity=identity) as session:
-        session.identity = identity
-
-        session.register_function('plugin.list', list_plugins)
-        session.register_function('plugin.restart', restart_plugin)
-
-        plugins, topo = load_plugins(config, session)
-        try:
-            for plugin in plugins.values():
-                plugin.process.join()
-        except KeyboardInterrupt:
-            pass
+def main():
+    global plugins, topo_index
+
+    import grpc
+
+    with open('config.yaml') as f:
+        config = Config.model_validate(yaml.load(f, Loader=yaml_loader()))
+
+    init_log()
+    init(config)
+    with grpc.insecure_channel(
+        config.server, options=(('grpc.default_authority', 'localhost'),)
+    ) as channel:
+        client = Client(channel)
+        identity = client.use_master_key(config.master_key)
+        with client.session(
+            SessionMode.IMMEDIATE, identity=identity
+        ) as session:
+            session.identity = identity
+
+            session.register_function('plugin.list', list_plugins)
+            session.register_function('plugin.restart', restart_plugin)
+
+            plugins, topo = load_plugins(config, session)
+            topo_index = {ident: i for i, ident in enumerate(topo)}
+            try:
+                for plugin in plugins.values():
+                    plugin.process.join()
+            except KeyboardInterrupt:
+                pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,12 @@
 import asyncio
 import inspect
-import multiprocessing as mp
+import json
 import os
-import runpy
 
-from dataclasses import dataclass
-from importlib.metadata import EntryPoint
+from dataclasses import asdict, dataclass
+from multiprocessing.connection import Connection
 from pathlib import Path
 
-from novi.plugin import initialize, join, ajoin
-
 from .misc import init_log
 
 
@@ -20,6 +17,8 @@ class EntryMain:
 
     async def run(self):
         if self.entry_point is not None:
+            from importlib.metadata import EntryPoint
+
             entry = EntryPoint(*self.entry_point)
             object = entry.load()
             if inspect.iscoroutinefunction(object):
@@ -30,6 +29,8 @@ class EntryMain:
                 raise ValueError('invalid entry point')
 
         elif self.file_path is not None:
+            import runpy
+
             runpy.run_path(self.file_path)
 
 
@@ -39,36 +40,55 @@ class EntryConfig:
 
     server: str
     identity: str
-    config_template: Path | None
+    config_template: str | None
     ipfs_gateway: str
 
     main: EntryMain
 
+    def to_json_bytes(self) -> bytes:
+        return json.dumps(asdict(self)).encode()
+
+    @classmethod
+    def from_json_bytes(cls, raw: bytes) -> 'EntryConfig':
+        data = json.loads(raw)
+        main = data['main']
+        if main['entry_point'] is not None:
+            main['entry_point'] = tuple(main['entry_point'])
+        data['main'] = EntryMain(**main)
+        return cls(**data)
 
-def entry_main(config: EntryConfig, plugin_dir: Path, registered: mp.Event):
-    os.chdir(str(plugin_dir))
+
+def entry_main(config_json: bytes, plugin_dir: str, ready: Connection):
+    from novi.plugin import initialize
+
+    os.chdir(plugin_dir)
     init_log()
 
-    # config = EntryConfig.model_validate_json(input())
-    if not config.config_template.exists():
-        config.config_template = None
+    config = EntryConfig.from_json_bytes(config_json)
+
+    # Checked on every spawn so a template added later shows up on restart
+    config_template = config.config_template
+    if config_template and not os.path.exists(config_template):
+        config_template = None
 
     initialize(
         identifier=config.identifier,
         server=config.server,
         identity=config.identity,
-        plugin_dir=Path(os.getcwd()),
-        config_template=config.config_template,
+        plugin_dir=Path(plugin_dir),
+        config_template=Path(config_template) if config_template else None,
         ipfs_gateway=config.ipfs_gateway,
     )
 
-    asyncio.run(_async_entry_main(config.main, registered))
+    asyncio.run(_async_entry_main(config, ready))
+
 
+async def _async_entry_main(config: EntryConfig, ready: Connection):
+    from novi.plugin import join, ajoin
 
-async def _async_entry_main(main: EntryMain, registered: mp.Event):
     try:
-        await main.run()
-        registered.set()
+        await config.main.run()
+        ready.send_bytes(config.identifier.encode())
         join()
         await ajoin()
     except KeyboardInterrupt:
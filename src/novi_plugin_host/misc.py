@@ -1,23 +1,89 @@
 import logging
-import structlog
 import sys
+import time
+
+from functools import cache
+
+_configured = False
+_timestamp = (0, '')
+
+
+def add_timestamp(logger, method_name, event_dict):
+    # strftime only runs once per second; records within the same second
+    # reuse the formatted string
+    global _timestamp
+    cached = _timestamp
+    now = int(time.time())
+    if cached[0] != now:
+        cached = now, time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(now))
+        _timestamp = cached
+
+    event_dict['timestamp'] = cached[1]
+    return event_dict
+
+
+def log_renderers():
+    import structlog
+
+    if sys.stderr.isatty():
+        return (structlog.dev.ConsoleRenderer(),)
+
+    try:
+        import orjson
+    except ImportError:
+        renderer = structlog.processors.JSONRenderer()
+    else:
+        renderer = structlog.processors.JSONRenderer(
+            serializer=lambda obj, **kw: orjson.dumps(obj, **kw).decode()
+        )
+
+    return structlog.processors.format_exc_info, renderer
 
 
 def init_log():
+    global _configured
+    if _configured:
+        return
+    _configured = True
+
+    import structlog
+
+    processors = (
+        structlog.processors.add_log_level,
+        structlog.contextvars.merge_contextvars,
+        add_timestamp,
+    )
+    renderers = log_renderers()
     structlog.configure(
         wrapper_class=structlog.make_filtering_bound_logger(logging.INFO),
-        logger_factory=structlog.stdlib.LoggerFactory(),
-        processors=[
-            structlog.stdlib.add_log_level,
-            structlog.stdlib.add_logger_name,
-            structlog.contextvars.merge_contextvars,
-            structlog.processors.StackInfoRenderer(),
-            structlog.processors.TimeStamper(fmt='%Y-%m-%d %H:%M:%S'),
-            structlog.dev.ConsoleRenderer(),
-        ],
+        logger_factory=structlog.PrintLoggerFactory(sys.stderr),
+        processors=processors + renderers,
+        cache_logger_on_first_use=True,
     )
-    logging.basicConfig(
-        format="%(message)s",
-        stream=sys.stderr,
-        level=logging.INFO,
+
+    # Records from libraries logging through stdlib are rendered the same
+    # way, without going through structlog a second time
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(
+        structlog.stdlib.ProcessorFormatter(
+            foreign_pre_chain=(
+                structlog.stdlib.add_logger_name,
+                *processors,
+            ),
+            processors=(
+                structlog.stdlib.ProcessorFormatter.remove_processors_meta,
+                *renderers,
+            ),
+        )
     )
+    logging.basicConfig(handlers=[handler], level=logging.INFO)
+
+
+@cache
+def yaml_loader():
+    try:
+        from yaml import CSafeLoader as Loader
+    except ImportError:
+        from yaml import SafeLoader as Loader
+
+    return Loader